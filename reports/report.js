@@ -128,3 +128,109 @@ function startAppPackages() {
 function closeSummary() {
     $('.summary').hide();
 }
+
+var RUNTIME_COLUMNS = {
+    freedesktop_platform: ['FD/P', 'org.freedesktop.Platform'],
+    gnome_platform: ['GN/P', 'org.gnome.Platform'],
+    freedesktop_sdk: ['FD/S', 'org.freedesktop.Sdk'],
+    gnome_sdk: ['GN/S', 'org.gnome.Sdk'],
+}
+
+function escapeHtml(s) {
+    return s.replace(/&/g, '&amp;').replace(/</g, '&lt;').replace(/>/g, '&gt;').replace(/"/g, '&quot;');
+}
+
+function letterRows(data, letter) {
+    var rows = [];
+
+    rows.push('<tr class="letter-header-above"></tr>');
+    rows.push('<tr class="letter-header"><th class="letter">' + escapeHtml(letter.letter) + '</th>');
+    for (let c of data.columns) {
+	rows.push('<th title="' + RUNTIME_COLUMNS[c][1] + '">' + RUNTIME_COLUMNS[c][0] + '</th>');
+    }
+    rows.push('<th>LIVE</th><th></th></tr>');
+
+    var empty = '<td></td>'.repeat(data.columns.length + 2);
+    for (let [spackage, packages] of letter.packages) {
+	rows.push('<tr class="source-package"><td>' + escapeHtml(spackage) + '</td>' + empty + '</tr>');
+	for (let [name, klass, inclusions, note] of packages) {
+	    // The last inclusion is the Live image, which has no details
+	    rows.push('<tr class="package ' + klass + '" data-package="' + escapeHtml(name) + '">' +
+		      '<td>' + escapeHtml(name) + '</td>');
+	    for (let i = 0; i < inclusions.length - 1; i++) {
+		rows.push('<td class="' + data.inclusions[inclusions[i]] + '" data-column="' + i + '"></td>');
+	    }
+	    rows.push('<td class="' + data.inclusions[inclusions[inclusions.length - 1]] + '"></td>' +
+		      '<td>' + escapeHtml(note) + '</td></tr>');
+	}
+    }
+
+    return rows;
+}
+
+function showLetter(data, selected) {
+    var rows = [];
+    for (let letter of data.letters) {
+	if (selected == 'All' || letter.letter == selected)
+	    rows.push(...letterRows(data, letter));
+    }
+
+    $('table.packages tbody').html(rows.join(''));
+    $('#letters li').removeClass('selected');
+    $('#letters li').filter(function() { return $(this).text() == selected }).addClass('selected');
+}
+
+var runtimeWhy = null;
+
+// The file lists and dependency chains are much bigger than the rest of
+// the report, so they are only fetched once the pointer first enters the
+// package table - usually over a package name, before it reaches a cell
+// with details
+function loadRuntimeWhy() {
+    if (runtimeWhy == null)
+	runtimeWhy = $.getJSON('runtime-why.json');
+    return runtimeWhy;
+}
+
+function setRuntimeTitles(why) {
+    $('table.packages td[data-column]').each(function() {
+	var td = $(this);
+	var details = why[td.closest('tr').attr('data-package')];
+	td.attr('title', details ? details[td.attr('data-column')] : '');
+    });
+}
+
+function startRuntimeReport() {
+    $.getJSON('runtime.json', function(data) {
+	if (data.baseonly)
+	    $('.summary tr.gnome').hide();
+
+	$('.summary .unmatched').each(function() {
+	    var count = data.unmatched[$(this).attr('data-runtime')];
+	    if (count > 0)
+		$(this).append($('<a></a>').attr('href', $(this).attr('data-file'))
+			       .text(count + ' unmatched'))
+		    .prepend('(').append(')');
+	});
+
+	for (let letter of data.letters.map(l => l.letter).concat(['All'])) {
+	    $('<li></li>').append($('<a></a>').attr('href', '#' + letter).text(letter))
+		.appendTo('#letters');
+	}
+
+	function showSelected() {
+	    var selected = decodeURIComponent(window.location.hash.substring(1));
+	    if (selected != 'All' && !data.letters.some(l => l.letter == selected))
+		selected = data.letters.length ? data.letters[0].letter : 'All';
+	    showLetter(data, selected);
+	    if (runtimeWhy != null)
+		runtimeWhy.done(setRuntimeTitles);
+	}
+	$(window).on('hashchange', showSelected);
+	showSelected();
+    });
+
+    $('table.packages').one('mouseenter', function() {
+	loadRuntimeWhy().done(setRuntimeTitles);
+    });
+}
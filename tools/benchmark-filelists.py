@@ -0,0 +1,82 @@
+#!/usr/bin/python3
+
+# Compares the speed of the XML backends used by util.foreach_file() on a
+# synthetic repository, and of a scan limited to one package's files.
+#
+# Usage: benchmark-filelists.py [N_PACKAGES [FILES_PER_PACKAGE]]
+
+import gzip
+from pathlib import Path
+import sys
+import tempfile
+import time
+import zstandard
+
+import util
+
+def write_filelists(f, n_packages, files_per_package):
+    f.write(b'<?xml version="1.0" encoding="UTF-8"?>\n')
+    f.write(b'<filelists xmlns="http://linux.duke.edu/metadata/filelists" '
+            b'packages="%d">\n' % n_packages)
+    for i in range(n_packages):
+        f.write(b'<package pkgid="%040d" name="package%d" arch="x86_64">\n' % (i, i))
+        f.write(b'  <version epoch="0" ver="1.%d" rel="1.fc43"/>\n' % i)
+        for j in range(files_per_package):
+            f.write(b'  <file>/usr/share/package%d/subdir%d/file-%d.txt</file>\n' % (i, j % 10, j))
+        f.write(b'  <file type="dir">/usr/share/package%d</file>\n' % i)
+        f.write(b'</package>\n')
+    f.write(b'</filelists>\n')
+
+def make_repo(topdir, suffix, n_packages, files_per_package):
+    repodata = topdir / suffix / 'repodata'
+    repodata.mkdir(parents=True)
+
+    filelists = 'repodata/filelists.xml.' + suffix
+    if suffix == 'zst':
+        f = zstandard.open(repodata.parent / filelists, 'wb')
+    else:
+        f = gzip.open(repodata.parent / filelists, 'wb', compresslevel=1)
+    with f:
+        write_filelists(f, n_packages, files_per_package)
+
+    with open(repodata / 'repomd.xml', 'w') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<repomd xmlns="http://linux.duke.edu/metadata/repo">\n'
+                f'  <data type="filelists"><location href="{filelists}"/></data>\n'
+                '</repomd>\n')
+
+    return util.RepoInfo(suffix, repodata)
+
+def time_backend(repo_info, backend, path_prefixes=None):
+    count = 0
+
+    def cb(records):
+        nonlocal count
+        for package_info, files in records:
+            count += len(files)
+
+    start = time.perf_counter()
+    util.foreach_file(repo_info, cb, backend=backend, path_prefixes=path_prefixes)
+
+    return time.perf_counter() - start, count
+
+def main():
+    n_packages = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    files_per_package = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+    util.set_log_name('benchmark-filelists.py')
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for suffix in ('gz', 'zst'):
+            repo_info = make_repo(Path(tmpdir), suffix, n_packages, files_per_package)
+            times = {}
+            for backend in ('sax', 'etree'):
+                times[backend], count = time_backend(repo_info, backend)
+            times['prefix'], _ = time_backend(repo_info, 'etree', ['/usr/share/package1/'])
+            print("{}: {} files, sax {:.2f}s, etree {:.2f}s ({:.1f}x), prefix {:.2f}s".format(
+                suffix, count, times['sax'], times['etree'], times['sax'] / times['etree'],
+                times['prefix']
+            ))
+
+if __name__ == '__main__':
+    main()
@@ -3,6 +3,23 @@ import os
 OS = os.getenv("OS")
 OS_VERSION = os.getenv("OS_VERSION")
 
+# Maximum number of parallel worker processes
+JOBS = int(os.getenv("JOBS") or 0) or os.cpu_count() or 1
+
+# If set, generate-runtime-report.py only solves the root packages added
+# since the previous run and merges them into its dependency closures, when
+# the repositories are unchanged and no root packages were removed. The
+# result can differ from a full solve.
+INCREMENTAL = os.getenv("INCREMENTAL", "") not in ("", "0")
+
+# Where generate-app-reports.py finds the list of Fedora Flatpaks; can be
+# pointed at a local stand-in server for testing
+SRC_FEDORAPROJECT_URL = os.getenv("SRC_FEDORAPROJECT_URL") or "https://src.fedoraproject.org"
+
+# If set, the list of Fedora Flatpaks is read from this file - a copy of
+# out/fedora-flatpaks.json from an earlier run - rather than fetched
+FEDORA_FLATPAKS_FIXTURE = os.getenv("FEDORA_FLATPAKS_FIXTURE") or None
+
 if OS == "fedora":
     RELEASE = f'f{OS_VERSION}'
     ID_PREFIX = 'org.fedoraproject'
@@ -1,10 +1,11 @@
 #!/usr/bin/python3
 
-from tempfile import NamedTemporaryFile
+import concurrent.futures
 import gi
 gi.require_version('AppStreamGlib', '1.0')
 from gi.repository import AppStreamGlib as AS
 from gi.repository import Gio
+import hashlib
 import json
 import locale
 import os
@@ -13,6 +14,7 @@ import requests
 import subprocess
 import sys
 
+import config
 import util
 
 id_mappings = {
@@ -88,29 +90,8 @@ def no_desktop(id):
     return id
 
 
-def make_desktop_map(repo_info):
-    desktop_map = {}
-
-    def cb(package_info, f):
-        if f.startswith("/usr/share/applications/"):
-            desktop_id = os.path.basename(f)
-            old = desktop_map.get(desktop_id)
-            if old is None or util.package_cmp(package_info, old) < 0:
-                desktop_map[desktop_id] = package_info
-
-    util.foreach_file(repo_info, cb)
-
-    for k in desktop_map:
-        desktop_map[k] = desktop_map[k][0]
-
-    return desktop_map
-
 def get_desktop_map():
-    return util.get_repo_map('desktop-map', make_desktop_map)
-
-util.set_log_name(os.path.basename(sys.argv[0]))
-
-desktop_map = get_desktop_map()
+    return util.get_repo_map('desktop-map')
 
 class Application:
     def __init__(self):
@@ -155,34 +136,196 @@ def iterate_apps(store):
         if is_desktop:
             yield app
 
+def load_store(path):
+    store = AS.Store()
+    store.from_file(Gio.File.new_for_path(path), "", None)
+
+    return store
+
+# Bump when the fields extracted from the AppStream data change, so old
+# caches aren't used
+APPSTREAM_CACHE_VERSION = 1
+
+def read_appstream(path, description, extract):
+    """Returns extract(app) for each desktop application in the AppStream data in path
+
+    Loading the data into an AppStreamGlib store and calling getters on
+    thousands of applications is slow, so the extracted fields are cached
+    in out/, keyed by the contents of path.
+    """
+    with open(path, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+
+    cache_path = path[:-len('.xml.gz')] + '.cache'
+    key = '{}:{}:{}'.format(APPSTREAM_CACHE_VERSION, extract.__name__, digest)
+    result = util.read_cache(cache_path, 'appstream', key)
+    if result is not None:
+        return result
+
+    util.start("Reading " + description)
+    result = [extract(app) for app in iterate_apps(load_store(path))]
+    util.write_cache(cache_path, 'appstream', key, result)
+    util.done()
+
+    return result
+
+def extract_fedora_app(app):
+    return (no_desktop(app.get_id()), app.get_name(), app.get_description(),
+            app.get_url_item(AS.UrlKind.HOMEPAGE), app.get_pkgnames()[0])
+
+def read_fedora_appstream():
+    """Returns (id, name, description, homepage, package) for each Fedora application"""
+    return read_appstream('out/fedora-appstream.xml.gz', "Fedora appstream", extract_fedora_app)
+
+def extract_flathub_app(app):
+    bundle_id = app.get_bundle_default().get_id()
+    prefix, flathub_id, arch, branch = bundle_id.split('/')
+
+    return (flathub_id, app.get_name(), app.get_description(),
+            app.get_url_item(AS.UrlKind.HOMEPAGE))
+
+def read_flathub_appstream():
+    """Returns (flathub_id, name, description, homepage) for each Flathub application"""
+    return read_appstream('out/flathub-appstream.xml.gz', "Flathub appstream", extract_flathub_app)
+
+def read_ratings():
+    with open('out/ratings.json') as f:
+        return json.load(f)
+
+# How many requests are made to src.fedoraproject.org at once
+FETCH_JOBS = 8
+
+class CachedFetcher:
+    """Fetches JSON documents over one pooled session, revalidating saved copies
+
+    Documents are requested by their path under base_url. The responses are
+    saved in a JSON file, by path, along with their ETag and
+    Last-Modified headers, and sent back as conditional requests the next
+    time, so a document that hasn't changed is answered with 304 Not
+    Modified and read from the file. If offline is True, nothing is fetched
+    and every document must be in the file.
+    """
+    def __init__(self, base_url, path, offline=False):
+        self.base_url = base_url
+        self.path = path
+        self.offline = offline
+        try:
+            with open(path) as f:
+                self.saved = json.load(f)
+        except FileNotFoundError:
+            if offline:
+                raise
+            self.saved = {}
+        self.fetched = {}
+
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=FETCH_JOBS)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def get(self, url_path):
+        saved = self.saved.get(url_path)
+        if self.offline:
+            if saved is None:
+                raise RuntimeError(f"{url_path} is not in {self.path}")
+            return saved['data']
+
+        headers = {}
+        if saved is not None:
+            if saved['etag'] is not None:
+                headers['If-None-Match'] = saved['etag']
+            if saved['last_modified'] is not None:
+                headers['If-Modified-Since'] = saved['last_modified']
+
+        response = self.session.get(self.base_url + '/' + url_path, headers=headers)
+        if response.status_code == 304 and saved is not None:
+            entry = saved
+        else:
+            response.raise_for_status()
+            entry = {
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'data': response.json(),
+            }
+        self.fetched[url_path] = entry
+
+        return entry['data']
+
+    def save(self):
+        """Replaces the saved documents with the ones fetched by this run"""
+        if self.offline:
+            return
+
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump(self.fetched, f, indent=4, sort_keys=True)
+        os.rename(self.path + '.tmp', self.path)
+
+def fedora_flatpaks_path(page):
+    return f'api/0/projects?namespace=flatpaks&fork=false&page={page}&per_page=100'
+
+def load_fedora_flatpaks():
+    util.start("Checking for Flatpaks in src.fedoraproject.org")
+
+    if config.FEDORA_FLATPAKS_FIXTURE is not None:
+        fetcher = CachedFetcher(config.SRC_FEDORAPROJECT_URL, config.FEDORA_FLATPAKS_FIXTURE,
+                                offline=True)
+    else:
+        fetcher = CachedFetcher(config.SRC_FEDORAPROJECT_URL, 'out/fedora-flatpaks.json')
+
+    # The first page tells us how many more there are; those are then
+    # requested all at once
+    first = fetcher.get(fedora_flatpaks_path(1))
+    n_pages = (first['total_projects'] + 99) // 100
+    with concurrent.futures.ThreadPoolExecutor(max_workers=FETCH_JOBS) as executor:
+        rest = list(executor.map(fetcher.get,
+                                 [fedora_flatpaks_path(page) for page in range(2, n_pages + 1)]))
+
+    flatpaks = set()
+    for data in [first] + rest:
+        for project in data['projects']:
+            flatpaks.add(project['name'])
+
+    fetcher.save()
+
+    util.done()
+
+    return flatpaks
+
+util.set_log_name(os.path.basename(sys.argv[0]))
+
+# Building the desktop map may scan repositories in forked processes, and
+# forking while other threads hold locks can deadlock the children, so it
+# is loaded before any other threads are started
+desktop_map = get_desktop_map()
+
+# The other inputs are independent of each other, and loading them is
+# mostly waiting on C code and the network, so they are all loaded at once
+# on threads, one per stage.
+stages = concurrent.futures.ThreadPoolExecutor(max_workers=4)
+
+fedora_apps_future = stages.submit(read_fedora_appstream)
+flathub_apps_future = stages.submit(read_flathub_appstream)
+ratings_future = stages.submit(read_ratings)
+fedora_flatpaks_future = stages.submit(load_fedora_flatpaks)
+
 id_to_application = {}
 name_to_application = {}
 homepage_to_application = {}
 
-fedora_store = AS.Store()
-fedora_store.from_file(Gio.File.new_for_path('out/fedora-appstream.xml.gz'), "", None)
-for app in iterate_apps(fedora_store):
+for fedora_id, name, description, homepage, package in fedora_apps_future.result():
     a = Application()
-    a.fedora_id = no_desktop(app.get_id())
-    a.name = app.get_name()
-    a.description = app.get_description()
-    a.homepage = app.get_url_item(AS.UrlKind.HOMEPAGE)
-    a.package = app.get_pkgnames()[0]
+    a.fedora_id = fedora_id
+    a.name = name
+    a.description = description
+    a.homepage = homepage
+    a.package = package
 
     id_to_application[a.fedora_id] = a
     name_to_application[a.name] = a
     homepage_to_application[a.homepage] = a
 
 
-flathub_store = AS.Store()
-flathub_store.from_file(Gio.File.new_for_path('out/flathub-appstream.xml.gz'), "", None)
-for app in iterate_apps(flathub_store):
-    bundle_id = app.get_bundle_default().get_id()
-    prefix, flathub_id, arch, branch = bundle_id.split('/')
-    name = app.get_name()
-    description = app.get_description()
-    homepage = app.get_url_item(AS.UrlKind.HOMEPAGE)
-
+for flathub_id, name, description, homepage in flathub_apps_future.result():
     id_app = id_to_application.get(flathub_id, None)
     if id_app is not None:
         id_app.flathub_id = flathub_id
@@ -229,10 +372,7 @@ for app in iterate_apps(flathub_store):
     a.flathub_id = flathub_id
     id_to_application[a.flathub_id] = a
 
-with open('out/ratings.json') as f:
-    ratings = json.load(f)
-
-for k, v in ratings.items():
+for k, v in ratings_future.result().items():
     k = no_desktop(k)
     a = id_to_application.get(k, None)
     if not a:
@@ -259,35 +399,6 @@ for k, v in ratings.items():
         old = 0
     a.star_total = old + v['total']
 
-def load_fedora_flatpaks():
-    print("Checking for Flatpaks in src.fedoraproject.org ... ", file=sys.stderr, end="")
-    flatpaks = set()
-
-    page = 1
-    retrieved = 0
-    while True:
-        response = requests.get(
-            'https://src.fedoraproject.org/'
-            f'api/0/projects?namespace=flatpaks&fork=false&page={page}&per_page=100'
-        )
-        response.raise_for_status()
-
-        data = response.json()
-        for project in data['projects']:
-            flatpaks.add(project['name'])
-            retrieved += 1
-
-        if retrieved >= data['total_projects']:
-            break
-
-        page += 1
-
-    print("done", file=sys.stderr)
-
-    return flatpaks
-
-fedora_flatpaks = load_fedora_flatpaks()
-
 locale.setlocale(locale.LC_ALL, '')
 
 fedora_appstream = 0
@@ -306,24 +417,124 @@ top_packaged_apps.sort(key=lambda a: -(a.star_total or 0))
 top_packaged_apps = top_packaged_apps[0:100]
 
 
-def get_flatpak_report(apps):
-    with NamedTemporaryFile("w") as stripped:
-        with open("out/runtime.profile") as f:
-            for line in f:
-                parts = line.strip().split()
-                name = parts[0]
-                if len(parts) == 2:
-                    arches = parts[1].split(",")
-                    if "x86_64" not in arches:
-                        continue
-                print(name, file=stripped)
-
-        info_json = util.depchase_output([
-            'flatpak-report',
-            '--runtime-profile', stripped.name
-        ] + [a.package for a in apps])
+def write_x86_64_profile():
+    """Writes the packages of out/runtime.profile that are on x86_64 to a profile of its own"""
+    path = "out/runtime-x86_64.profile"
+    names = []
+    with open("out/runtime.profile") as f:
+        for line in f:
+            parts = line.strip().split()
+            name = parts[0]
+            if len(parts) == 2:
+                arches = parts[1].split(",")
+                if "x86_64" not in arches:
+                    continue
+            names.append(name + "\n")
+
+    # Left alone if the runtime didn't change on x86_64
+    util.write_if_changed(path, "".join(names))
+
+    return path
+
+
+# Bump when the contents of the flatpak-report cache change, so old caches
+# aren't used
+FLATPAK_REPORT_CACHE_VERSION = 2
+
+# The most applications passed to one flatpak-report run, which keeps the
+# command line well short of ARG_MAX
+FLATPAK_REPORT_CHUNK_SIZE = 250
+
+def split_flatpak_report(info, app_packages):
+    """Splits a flatpak-report into the part for each application
+
+    Each part has the application's entry in 'flatpaks' (None if
+    flatpak-report didn't find the package), and the fields other than
+    used_by of each package it uses. Packages that no application uses
+    are kept separately, under 'unused'.
+    """
+    parts = {p: {'flatpak': info['flatpaks'].get(p), 'packages': {}} for p in app_packages}
+    unused = {}
+    for p, i in info['packages'].items():
+        fields = {k: v for k, v in i.items() if k != 'used_by'}
+        if not i['used_by']:
+            unused[p] = fields
+        for app in i['used_by']:
+            if app not in parts:
+                raise RuntimeError(f"flatpak-report says {p} is used by {app}, "
+                                   "which it wasn't asked about")
+            parts[app]['packages'][p] = fields
+
+    return {'apps': parts, 'unused': unused}
+
+def merge_flatpak_reports(results, app_packages):
+    """Puts the parts from split_flatpak_report() back together into one report"""
+    info = {'flatpaks': {}, 'packages': {}}
+    for app in app_packages:
+        result = results['apps'][app]
+        if result['flatpak'] is not None:
+            info['flatpaks'][app] = result['flatpak']
+        for p, fields in result['packages'].items():
+            package = info['packages'].get(p)
+            if package is None:
+                package = info['packages'][p] = dict(fields, used_by=[])
+            package['used_by'].append(app)
+
+    for p, fields in results['unused'].items():
+        if p not in info['packages']:
+            info['packages'][p] = dict(fields, used_by=[])
+
+    return info
 
-    return json.loads(info_json)
+def get_flatpak_report(apps):
+    """Runs flatpak-report for apps, only solving the applications not in the cache
+
+    Each application is solved on its own, so its part of the report only
+    depends on the runtime profile and the repositories - which also pin
+    the version of the application's package. The parts are cached in out/
+    for as long as those are unchanged, so a run only has to solve the
+    applications that are new since the last one. For the same reason, the
+    applications that do need solving can be split into chunks that are
+    run in parallel, and the merged result is the same as from one run.
+    """
+    profile = write_x86_64_profile()
+    with open(profile, 'rb') as f:
+        profile_hash = hashlib.sha256(f.read()).hexdigest()
+
+    cache_path = 'out/flatpak-report.cache'
+    key = json.dumps({
+        'version': FLATPAK_REPORT_CACHE_VERSION,
+        'profile': profile_hash,
+        'repos': util.depchase_repos_key(),
+    })
+    results = util.read_cache(cache_path, 'flatpak-report', key)
+    if results is None:
+        results = {'apps': {}, 'unused': {}}
+
+    app_packages = sorted({a.package for a in apps})
+    to_solve = [p for p in app_packages if p not in results['apps']]
+    if to_solve:
+        # Split into at least one chunk per job, so the runs are spread over
+        # config.JOBS processes
+        chunk_size = min(FLATPAK_REPORT_CHUNK_SIZE, -(-len(to_solve) // config.JOBS))
+        chunks = [to_solve[i:i + chunk_size] for i in range(0, len(to_solve), chunk_size)]
+
+        def solve_chunk(chunk):
+            info_json = util.depchase_output([
+                'flatpak-report',
+                '--runtime-profile', profile
+            ] + chunk, input_files=[profile])
+
+            return split_flatpak_report(json.loads(info_json), chunk)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=config.JOBS) as executor:
+            for chunk_results in executor.map(solve_chunk, chunks):
+                results['apps'].update(chunk_results['apps'])
+                results['unused'].update(chunk_results['unused'])
+
+        util.write_cache(cache_path, 'flatpak-report', key, results)
+
+    return merge_flatpak_reports(results, app_packages)
 
 
 info = get_flatpak_report(packaged_apps)
@@ -332,6 +543,10 @@ for a in packaged_apps:
     if app_info:  # package info from appstream might be stale
         a.extra_packages = info['flatpaks'][a.package]['extra']
 
+# Each application is solved on its own, so what the top applications use
+# is the part of the report for all applications that they are in
+top_package_names = {a.package for a in top_packaged_apps}
+
 runtime_packages = {}
 extra_packages = {}
 for p, i in info['packages'].items():
@@ -340,13 +555,12 @@ for p, i in info['packages'].items():
     else:
         extra_packages[p] = {'all': i['used_by']}
 
-top_info = get_flatpak_report(top_packaged_apps)
-
-for p, i in top_info['packages'].items():
-    if i['runtime']:
-        runtime_packages[p]['top'] = i['used_by']
-    else:
-        extra_packages[p]['top'] = i['used_by']
+    top_used_by = [a for a in i['used_by'] if a in top_package_names]
+    if top_used_by:
+        if i['runtime']:
+            runtime_packages[p]['top'] = top_used_by
+        else:
+            extra_packages[p]['top'] = top_used_by
 
 def dict_to_list(packages):
     result = []
@@ -390,6 +604,8 @@ def sanitize_description(description):
     )
     return description
 
+fedora_flatpaks = fedora_flatpaks_future.result()
+
 for a in sorted(apps, key=lambda a: (locale.strxfrm(a.display_name), a.canon_id)):
     if a.fedora_id is not None:
         fedora_appstream += 1
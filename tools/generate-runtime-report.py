@@ -1,13 +1,15 @@
 #!/usr/bin/python3
 
 from typing import Iterable
-from jinja2 import Environment, FileSystemLoader, select_autoescape
+import concurrent.futures
+from functools import cached_property
 import json
 import locale
 import os
 import re
 import sys
 
+import config
 from config import ALL_ARCHES, BASEONLY
 import util
 
@@ -26,51 +28,32 @@ def warn(msg):
 def nvr_to_name(nvr):
     return nvr.rsplit("-", 2)[0]
 
-def make_devel_packages(repo_info):
-    devel_packages = {}
-
-    start("Making devel package map")
-    def cb(name, srpm):
-        if name.endswith('-devel') and name != 'gdk-pixbuf2-xlib-devel':
-            srpm_name = srpm.rsplit('-', 2)[0]
-            devel_packages[srpm_name] = name
-    done()
-
-    util.foreach_package(repo_info, cb)
-
-    return devel_packages
+# The runtimes that packages can be included in, and the Live image
+RUNTIMES = ('freedesktop_platform', 'freedesktop_sdk', 'gnome_platform', 'gnome_sdk', 'live')
+FREEDESKTOP_PLATFORM, FREEDESKTOP_SDK, GNOME_PLATFORM, GNOME_SDK, LIVE = range(len(RUNTIMES))
 
 class Package(object):
+    # There are thousands of packages, so use slots rather than an instance dict.
+    # level, arches, files and required_by are lists indexed by runtime
+    __slots__ = ('name', 'source_package_name', 'flag', '_note',
+                 'level', 'arches', 'files', 'required_by')
+
     def __init__(self, name):
         self.name = name
-        self.freedesktop_platform = 0
-        self.freedesktop_platform_arches = None
-        self.freedesktop_platform_files = None
-        self.freedesktop_platform_required_by = None
-        self.gnome_platform = 0
-        self.gnome_platform_arches = None
-        self.gnome_platform_files = None
-        self.gnome_platform_required_by = None
-        self.freedesktop_sdk = 0
-        self.freedesktop_sdk_arches = None
-        self.freedesktop_sdk_files = None
-        self.freedesktop_sdk_required_by = None
-        self.gnome_sdk = 0
-        self.gnome_sdk_arches = None
-        self.gnome_sdk_files = None
-        self.gnome_sdk_required_by = None
-        self.live = 0
-        self.live_arches = 0
+        self.level = [0] * len(RUNTIMES)
+        self.arches = [0] * len(RUNTIMES)
+        self.files = [None] * len(RUNTIMES)
+        self.required_by = [None] * len(RUNTIMES)
         self.source_package_name = None
         self.flag = None
         self._note = None
 
     @property
     def runtimes(self):
-        return (self.freedesktop_platform
-                or self.gnome_platform
-                or self.freedesktop_sdk
-                or self.gnome_sdk)
+        return (self.level[FREEDESKTOP_PLATFORM]
+                or self.level[GNOME_PLATFORM]
+                or self.level[FREEDESKTOP_SDK]
+                or self.level[GNOME_SDK])
 
     @property
     def klass(self):
@@ -96,15 +79,15 @@ class Package(object):
     def note(self):
         if self._note:
             return self._note
-        elif not BASEONLY and self.gnome_platform and not self.live:
+        elif not BASEONLY and self.level[GNOME_PLATFORM] and not self.level[LIVE]:
             return "platform package not on Live image"
-        elif BASEONLY and self.freedesktop_platform and not self.live:
+        elif BASEONLY and self.level[FREEDESKTOP_PLATFORM] and not self.level[LIVE]:
             return "platform package not on Live image"
         else:
             return ""
 
-    def why(self, which):
-        files = getattr(self, which + '_files')
+    def why(self, runtime):
+        files = self.files[runtime]
         if files is None:
             files_str = ''
         elif len(files) <= 3:
@@ -112,7 +95,7 @@ class Package(object):
         else:
             files_str = 'Files: ' + ' '.join(files[:3]) + ' ...'
 
-        required_by = getattr(self, which + '_required_by')
+        required_by = self.required_by[runtime]
         if required_by is None:
             required_by_str = ''
         else:
@@ -128,60 +111,20 @@ class Package(object):
         else:
             return ''
 
-    @property
-    def freedesktop_platform_why(self):
-        return self.why('freedesktop_platform')
-
-    @property
-    def freedesktop_sdk_why(self):
-        return self.why('freedesktop_sdk')
-
-    @property
-    def gnome_platform_why(self):
-        return self.why('gnome_platform')
-
-    @property
-    def gnome_sdk_why(self):
-        return self.why('gnome_sdk')
-
-    def inclusion(self, which):
-        level = getattr(self, which)
+    def inclusion(self, runtime):
+        level = self.level[runtime]
         if level == 0:
             return 'absent'
         elif level == 1:
             return 'dep'
+        elif runtime == LIVE:
+            return 'present'
+        elif self.required_by[runtime]:
+            return 'files'
+        elif self.flag is not None and self.flag.startswith('E'):
+            return 'extra'
         else:
-            required_by = getattr(self, which + '_required_by', False)
-            if required_by is False:
-                return 'present'
-            else:
-                assert required_by is None or isinstance(required_by, list)
-                if required_by is not None and len(required_by) > 0:
-                    return 'files'
-                elif self.flag is not None and self.flag.startswith('E'):
-                    return 'extra'
-                else:
-                    return 'root'
-
-    @property
-    def freedesktop_platform_inclusion(self):
-        return self.inclusion('freedesktop_platform')
-
-    @property
-    def freedesktop_sdk_inclusion(self):
-        return self.inclusion('freedesktop_sdk')
-
-    @property
-    def gnome_platform_inclusion(self):
-        return self.inclusion('gnome_platform')
-
-    @property
-    def gnome_sdk_inclusion(self):
-        return self.inclusion('gnome_sdk')
-
-    @property
-    def live_inclusion(self):
-        return self.inclusion('live')
+            return 'root'
 
     @property
     def source_package(self):
@@ -197,7 +140,7 @@ class SourcePackage(object):
     def klass(self):
         return ""
 
-    @property
+    @cached_property
     def devel_missing(self):
         devel = devel_packages.get(self.name)
         if devel is not None:
@@ -221,8 +164,15 @@ ARCH_MAP = {
     "x86_64": "amd64",
 }
 
+# Sets of architectures are bitmasks, with a bit for each of ALL_ARCHES
+ARCH_BITS = {arch: 1 << i for i, arch in enumerate(ALL_ARCHES)}
+ALL_ARCHES_MASK = (1 << len(ALL_ARCHES)) - 1
+
+def arches_list(mask):
+    return [arch for arch, bit in ARCH_BITS.items() if mask & bit]
+
 packages = dict()
-def add_package(name, which, arches, level, only_if_exists=False, source_package=None):
+def add_package(name, runtime, arches, level, only_if_exists=False, source_package=None):
     pkg = packages.get(name, None)
     if pkg is None:
         if only_if_exists:
@@ -230,73 +180,169 @@ def add_package(name, which, arches, level, only_if_exists=False, source_package
         pkg = Package(name)
         packages[name] = pkg
 
-    old_arches = getattr(pkg, which + "_arches")
-    if old_arches is not ALL_ARCHES:
-        if arches is not ALL_ARCHES:
-            if old_arches is None:
-                new_arches = arches
-            else:
-                new_arches = [a for a in ARCH_MAP if a in arches or a in old_arches]
-                if new_arches == ALL_ARCHES:
-                    new_arches = ALL_ARCHES
-            setattr(pkg, which + "_arches", new_arches)
-        else:
-            setattr(pkg, which + "_arches", ALL_ARCHES)
+    pkg.arches[runtime] |= arches
 
-    if getattr(pkg, which) < level:
-        setattr(pkg, which, level)
+    if pkg.level[runtime] < level:
+        pkg.level[runtime] = level
     if source_package is not None:
         pkg.source_package_name = source_package
 
 
-def resolve_packages_all_arches(pkgs: Iterable[str], platform_only=False):
+# Always put in the systemd-standalone-tmpfiles so the requirements are
+# satisfied for samba-common that would otherwise pulled in the whole
+# systemd
+# Always use the flatpak variant of fedora-release instead of the generic
+IMPLICIT_PACKAGES = {"systemd-standalone-tmpfiles", "fedora-release-identity-flatpak"}
+
+def with_implicit_packages(pkgs: Iterable[str]):
+    return set(pkgs) | IMPLICIT_PACKAGES
+
+def read_packages(filename):
+    with open(filename) as f:
+        return set(line.strip() for line in f)
+
+
+# Each depchase run is a separate process, so threads are enough to run
+# config.JOBS of them at once
+_solver_pool = concurrent.futures.ThreadPoolExecutor(max_workers=config.JOBS)
+_solves = {}
+# The runtimes whose closures came from merging solves, see solve_incrementally()
+_merged_closures = set()
+# Bump when the stored closures change
+CLOSURE_CACHE_VERSION = 2
+
+def solve_incrementally(name, pkgs, arch, platform_only=False, reuse=True):
+    """Returns depchase resolve-packages output for pkgs, reusing the previous run if possible
+
+    The roots and closure from the last run for name and arch are kept in
+    out/. If reuse is set, the repositories haven't changed and no roots
+    were removed, only the added roots that aren't already in the closure
+    are solved, and their closure is merged into the stored one; packages
+    that were already in it keep their explanations. If the two solves
+    picked different builds of a package, or roots were removed (the
+    closure doesn't record what else still needs their dependencies), the
+    roots are solved from scratch.
+
+    The merged closure is not checked against a solve of all the roots:
+    solving the added roots on their own can pick a different provider for
+    something the closure already provides, so it can contain packages
+    that a full solve wouldn't. Such closures are remembered as merged
+    until the roots are next solved from scratch - which a run without
+    reuse always does - and name is added to _merged_closures.
+    """
+    pkgs = set(pkgs)
+    path = os.path.join('out', 'closure-' + name + '-' + arch + '.cache')
+    key = '{}:{}'.format(CLOSURE_CACHE_VERSION,
+                         util.depchase_repos_key(arch=ARCH_MAP[arch], platform_only=platform_only))
+
+    def solve(roots):
+        return json.loads(util.depchase_output(
+            ['resolve-packages', '--json'] + sorted(roots),
+            arch=ARCH_MAP[arch], platform_only=platform_only
+        ))
+
+    resolved = None
+    previous = util.read_cache(path, 'closure', key) if reuse else None
+    if previous is not None and previous[0] <= pkgs:
+        old_pkgs, closure, merged = previous
+        by_name = {nvr_to_name(package['nvra']): package for package in closure}
+        added = pkgs - old_pkgs
+
+        # Added roots that were already pulled in only lose their explanations
+        for pkg_name in added & by_name.keys():
+            by_name[pkg_name].pop('explanation', None)
+
+        resolved = closure
+        new_roots = added - by_name.keys()
+        if new_roots:
+            merged = True
+            for package in solve(new_roots):
+                old = by_name.setdefault(nvr_to_name(package['nvra']), package)
+                if old is package:
+                    closure.append(package)
+                elif old['nvra'] != package['nvra']:
+                    resolved = None
+                    break
+
+    if resolved is None:
+        resolved = solve(pkgs)
+        merged = False
+
+    util.write_cache(path, 'closure', key, (pkgs, resolved, merged))
+    if merged:
+        _merged_closures.add(name)
+
+    return json.dumps(resolved)
+
+
+def start_resolve_packages(pkgs: Iterable[str], platform_only=False, name=None):
+    """Starts resolving pkgs for each of ALL_ARCHES in the background
+
+    Returns a list of futures for the output of depchase, in the order of
+    ALL_ARCHES. name identifies the closure to store, and if
+    config.INCREMENTAL is set, to reuse, see solve_incrementally().
+    """
+    key = (tuple(sorted(set(pkgs))), platform_only)
+    if key not in _solves:
+        if name is not None:
+            _solves[key] = [
+                _solver_pool.submit(solve_incrementally, name, key[0], arch,
+                                    platform_only=platform_only, reuse=config.INCREMENTAL)
+                for arch in ALL_ARCHES
+            ]
+        else:
+            args = ['resolve-packages', '--json'] + list(key[0])
+            _solves[key] = [
+                _solver_pool.submit(util.depchase_output, args,
+                                    arch=ARCH_MAP[arch], platform_only=platform_only)
+                for arch in ALL_ARCHES
+            ]
+
+    return _solves[key]
+
+
+def resolve_packages_all_arches(pkgs: Iterable[str], platform_only=False, name=None):
     resolved_packages = {}
 
-    for arch in ALL_ARCHES:
-        arch_resolved_packages = json.loads(
-            util.depchase_output([
-                'resolve-packages', '--json'
-            ] + sorted(pkgs), arch=ARCH_MAP[arch], platform_only=platform_only)
-        )
+    # Results are merged in the order of ALL_ARCHES, however the solves finish
+    futures = start_resolve_packages(pkgs, platform_only=platform_only, name=name)
+    for arch, future in zip(ALL_ARCHES, futures):
+        arch_resolved_packages = json.loads(future.result())
+        bit = ARCH_BITS[arch]
 
         for package in arch_resolved_packages:
-            name = nvr_to_name(package['nvra'])
+            pkg_name = nvr_to_name(package['nvra'])
 
-            if name in resolved_packages:
-                resolved_packages[name]["arches"].append(arch)
+            if pkg_name in resolved_packages:
+                resolved_packages[pkg_name]["arches"] |= bit
             else:
-                resolved_packages[name] = package
-                package["arches"] = [arch]
-
-    for package in resolved_packages.values():
-        if package["arches"] == ALL_ARCHES:
-            package["arches"] = ALL_ARCHES
+                resolved_packages[pkg_name] = package
+                package["arches"] = bit
 
     return list(resolved_packages.values())
 
 
-def add_packages(source, which, resolve_deps=False, only_if_exists=False, platform_only=False):
+def add_packages(source, runtime, resolve_deps=False, only_if_exists=False, platform_only=False,
+                 extra_pkgs=()):
+    """Adds the packages in source, a filename or a list of names, to runtime
+
+    If resolve_deps is set, extra_pkgs are added along with source, and
+    the dependencies of both are resolved together.
+    """
     if isinstance(source, str):
         start("Adding packages from {}".format(source))
-        with open(source) as f:
-            pkgs = set(line.strip() for line in f)
+        pkgs = read_packages(source)
     else:
         pkgs = source
 
     if resolve_deps:
-        # Always put in the systemd-standalone-tmpfiles so the requirements are
-        # satisfied for samba-common that would otherwise pulled in the whole
-        # systemd
-        # Always use the flatpak variant of fedora-release instead of the generic
-        if isinstance(pkgs, list):
-            pkgs += ["systemd-standalone-tmpfiles", "fedora-release-identity-flatpak"]
-        elif isinstance(pkgs, set):
-            pkgs.update({"systemd-standalone-tmpfiles", "fedora-release-identity-flatpak"})
-        resolved_packages = resolve_packages_all_arches(pkgs, platform_only=platform_only)
+        pkgs = with_implicit_packages(pkgs) | set(extra_pkgs)
+        resolved_packages = resolve_packages_all_arches(pkgs, platform_only=platform_only,
+                                                        name=RUNTIMES[runtime])
         for package in resolved_packages:
             name = nvr_to_name(package['nvra'])
             srpm_name = package['source']
-            add_package(name, which, arches=package.get("arches"),
+            add_package(name, runtime, arches=package["arches"],
                         level=(2 if name in pkgs else 1),
                         source_package=srpm_name, only_if_exists=only_if_exists)
 
@@ -313,29 +359,28 @@ def add_packages(source, which, resolve_deps=False, only_if_exists=False, platfo
 
                 required_by_package = explanation[pos]
                 req = explanation[pos + 1]
-                required_by = getattr(pkg, which + '_required_by')
+                required_by = pkg.required_by[runtime]
                 if required_by is None:
-                    required_by = []
-                    setattr(pkg, which + '_required_by', required_by)
+                    required_by = pkg.required_by[runtime] = []
                 required_by.append((required_by_package, req))
     else:
         for package in pkgs:
-            add_package(package, which, arches=ALL_ARCHES, level=2, only_if_exists=only_if_exists)
+            add_package(package, runtime, arches=ALL_ARCHES_MASK, level=2,
+                        only_if_exists=only_if_exists)
 
     if isinstance(source, str):
         done()
 
-def add_package_files(filename, which):
+def add_package_files(filename, runtime):
     with open(filename) as f:
         for line in f:
             f, p = line.strip().rsplit(' ', 1)
             f = f[:-1]  # strip trailing :
             pkg = packages[p]
-            old = getattr(pkg, which + '_files')
-            if old is not None:
-                old.append(f)
+            if pkg.files[runtime] is not None:
+                pkg.files[runtime].append(f)
             else:
-                setattr(pkg, which + '_files', [f])
+                pkg.files[runtime] = [f]
 
 def read_package_notes():
     comment_re = re.compile(r'\s*#.*')
@@ -377,24 +422,21 @@ def read_package_notes():
 
             yield name, note, flag
 
-devel_packages = util.get_repo_map('devel-packages', make_devel_packages)
+util.set_log_name(os.path.basename(sys.argv[0]))
 
-add_packages('out/freedesktop-Platform.packages', 'freedesktop_platform',
-             resolve_deps=True, platform_only=True)
-add_packages('out/freedesktop-Sdk.packages', 'freedesktop_sdk', resolve_deps=True)
-if not BASEONLY:
-    add_packages('out/gnome-Platform.packages', 'gnome_platform',
-                 resolve_deps=True, platform_only=True)
-    add_packages('out/gnome-Sdk.packages', 'gnome_sdk', resolve_deps=True)
-add_packages('data/f42-live.packages', 'live', only_if_exists=True)
+devel_packages = util.get_repo_map('devel-packages')
 
-add_package_files('out/freedesktop-Platform.matched', 'freedesktop_platform')
-add_package_files('out/freedesktop-Sdk.matched', 'freedesktop_sdk')
+runtimes = [
+    ('freedesktop-Platform', FREEDESKTOP_PLATFORM, True),
+    ('freedesktop-Sdk', FREEDESKTOP_SDK, False),
+]
 if not BASEONLY:
-    add_package_files('out/gnome-Platform.matched', 'gnome_platform')
-    add_package_files('out/gnome-Sdk.matched', 'gnome_sdk')
+    runtimes += [
+        ('gnome-Platform', GNOME_PLATFORM, True),
+        ('gnome-Sdk', GNOME_SDK, False),
+    ]
 
-# Add extra packages
+# Extra packages from package-notes.txt
 extra_base = []
 extra_base_sdk = []
 extra = []
@@ -415,11 +457,34 @@ for name, note, flag in read_package_notes():
     elif flag == 'E_SDK':
         extra_sdk.append(name)
 
-add_packages(extra_base, 'freedesktop_platform', resolve_deps=True)
-add_packages(extra_base_sdk, 'freedesktop_sdk', resolve_deps=True)
-if not BASEONLY:
-    add_packages(extra, 'gnome_platform', resolve_deps=True)
-    add_packages(extra_sdk, 'gnome_sdk', resolve_deps=True)
+extras = {
+    FREEDESKTOP_PLATFORM: extra_base,
+    FREEDESKTOP_SDK: extra_base_sdk,
+    GNOME_PLATFORM: extra,
+    GNOME_SDK: extra_sdk,
+}
+
+# Each runtime is solved once per architecture, for the packages its files
+# resolved to and its extra packages together. Start all the solves at
+# once, so they run in parallel; add_packages() then collects the results
+# in order
+for name, runtime, platform_only in runtimes:
+    start_resolve_packages(with_implicit_packages(read_packages('out/' + name + '.packages'))
+                           | set(extras[runtime]),
+                           platform_only=platform_only, name=RUNTIMES[runtime])
+
+for name, runtime, platform_only in runtimes:
+    add_packages('out/' + name + '.packages', runtime,
+                 resolve_deps=True, platform_only=platform_only, extra_pkgs=extras[runtime])
+add_packages('data/f42-live.packages', LIVE, only_if_exists=True)
+
+if _merged_closures:
+    warn("Closures for {} include separately solved roots and can differ from a full solve; "
+         "run without INCREMENTAL before using the profiles".format(
+             ", ".join(sorted(_merged_closures))))
+
+for name, runtime, platform_only in runtimes:
+    add_package_files('out/' + name + '.matched', runtime)
 
 source_packages = {}
 for package in packages.values():
@@ -480,39 +545,77 @@ if not BASEONLY:
 #
 # Generate the profiles
 #
-def generate_profile(outfile, which):
+def generate_profile(outfile, runtime):
     with open(outfile, 'w') as f:
         for letter in letters:
             for src in letter.packages:
                 for pkg in src.packages:
-                    if getattr(pkg, which) != 0:
-                        arches = getattr(pkg, which + "_arches")
-                        if arches is not ALL_ARCHES:
-                            print(pkg.name, ",".join(arches), file=f)
+                    if pkg.level[runtime] != 0:
+                        arches = pkg.arches[runtime]
+                        if arches != ALL_ARCHES_MASK:
+                            print(pkg.name, ",".join(arches_list(arches)), file=f)
                         else:
                             print(pkg.name, file=f)
 
-generate_profile('out/runtime-base.profile', 'freedesktop_platform')
-generate_profile('out/sdk-base.profile', 'freedesktop_sdk')
+generate_profile('out/runtime-base.profile', FREEDESKTOP_PLATFORM)
+generate_profile('out/sdk-base.profile', FREEDESKTOP_SDK)
 
 if not BASEONLY:
-    generate_profile('out/runtime.profile', 'gnome_platform')
-    generate_profile('out/sdk.profile', 'gnome_sdk')
+    generate_profile('out/runtime.profile', GNOME_PLATFORM)
+    generate_profile('out/sdk.profile', GNOME_SDK)
 
 #
 # Generate the report
 #
 
-env = Environment(
-    loader=FileSystemLoader('.'),
-    autoescape=select_autoescape(['html', 'xml']),
-    trim_blocks=True,
-    lstrip_blocks=True
-)
-
-template = env.get_template('runtime-template.html')
+# The runtime columns of the report, in order
+if BASEONLY:
+    columns = [FREEDESKTOP_PLATFORM, FREEDESKTOP_SDK]
+else:
+    columns = [FREEDESKTOP_PLATFORM, GNOME_PLATFORM, FREEDESKTOP_SDK, GNOME_SDK]
+
+# Each cell of a row is written as a single character, rather than as the
+# CSS class that reports/report.js turns it back into
+INCLUSION_CODES = {
+    'absent': '-',
+    'dep': 'd',
+    'files': 'f',
+    'root': 'r',
+    'extra': 'e',
+    'present': 'p',
+}
 
-with open('reports/runtime.html', 'w') as f:
-    f.write(template.render(baseonly=BASEONLY,
-                            letters=letters,
-                            unmatched=unmatched_counts))
+def package_row(pkg):
+    inclusions = ''.join(INCLUSION_CODES[pkg.inclusion(runtime)] for runtime in columns + [LIVE])
+    return [pkg.name, pkg.klass, inclusions, pkg.note]
+
+def write_json(path, data):
+    # Renamed into place at the end, so a failed run doesn't leave a partial file
+    with open(path + '.tmp', 'w') as f:
+        json.dump(data, f, separators=(',', ':'))
+    os.rename(path + '.tmp', path)
+
+# reports/runtime.html renders the report a letter at a time from this
+write_json('reports/runtime.json', {
+    'baseonly': BASEONLY,
+    'columns': [RUNTIMES[runtime] for runtime in columns],
+    'inclusions': {v: k for k, v in INCLUSION_CODES.items()},
+    'unmatched': unmatched_counts,
+    'letters': [{
+        'letter': letter.letter,
+        'packages': [
+            [src.name, [package_row(pkg) for pkg in src.packages]]
+            for src in letter.packages
+        ],
+    } for letter in letters],
+})
+
+# The tooltips of the runtime cells are most of the size of the report,
+# so they are in a separate file that is only loaded when needed
+why = {}
+for pkg in packages.values():
+    details = [pkg.why(runtime) for runtime in columns]
+    if any(details):
+        why[pkg.name] = details
+
+write_json('reports/runtime-why.json', why)
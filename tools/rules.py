@@ -0,0 +1,259 @@
+from functools import cached_property
+import hashlib
+import os
+import re
+import tomllib
+
+import util
+from util import start, done
+
+# Characters that end the literal prefix of a regular expression
+_SPECIAL = set('.^$*+?{}[]\\|()')
+
+def has_top_level_alternation(pattern):
+    """Returns True if pattern has a | that isn't inside a group or a character class"""
+    depth = 0
+    in_class = False
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == '\\':
+            i += 2
+            continue
+
+        if in_class:
+            if c == ']':
+                in_class = False
+        elif c == '[':
+            in_class = True
+            # A ] right after [ or [^ is a literal
+            if pattern[i + 1:i + 2] == '^':
+                i += 1
+            if pattern[i + 1:i + 2] == ']':
+                i += 1
+        elif c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+        elif c == '|' and depth == 0:
+            return True
+
+        i += 1
+
+    return False
+
+def literal_prefix(pattern):
+    """Returns a string that anything matching pattern with re.match() must start with"""
+    # Each alternative can start differently
+    if has_top_level_alternation(pattern):
+        return ''
+
+    prefix = []
+
+    i = 1 if pattern.startswith('^') else 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == '\\':
+            # \. \+ etc. are literal; \d \w \1 etc. are not
+            if i + 1 < len(pattern) and not pattern[i + 1].isalnum():
+                literal = pattern[i + 1]
+                step = 2
+            else:
+                break
+        elif c in _SPECIAL:
+            break
+        else:
+            literal = c
+            step = 1
+
+        quantifier = pattern[i + step:i + step + 1]
+        if quantifier in ('*', '?', '{'):
+            break
+        prefix.append(literal)
+        if quantifier == '+':
+            break
+
+        i += step
+
+    return ''.join(prefix)
+
+
+# Things that stop a pattern from being combined with others into one
+# alternation: backreferences, conditionals and named groups refer to groups
+# that would be renumbered or clash, and global flags such as (?i) are only
+# allowed at the start of the whole expression. This may match more than
+# it needs to, which only costs speed.
+_UNCOMBINABLE = re.compile(r'\\[1-9]|\(\?P[=<]|\(\?\(|\(\?[aiLmsux]+\)')
+
+class PatternSet:
+    """A list of regular expressions matched all at once
+
+    The patterns are compiled into a single alternation, so matching a
+    string is one call into the regular expression engine, which stops at
+    the first pattern that matches. Patterns that wouldn't mean the same
+    thing inside the alternation are matched separately.
+    """
+    def __init__(self, patterns):
+        combined = [p for p in patterns if not _UNCOMBINABLE.search(p)]
+        if combined:
+            self.pattern = '|'.join('(?:{})'.format(p) for p in combined)
+        else:
+            self.pattern = None
+        self.separate = [p for p in patterns if _UNCOMBINABLE.search(p)]
+
+    # Compiled on first use; compiled patterns pickle as their source, so
+    # there's nothing to gain from storing them in the rules cache
+    @cached_property
+    def regex(self):
+        return re.compile(self.pattern) if self.pattern is not None else None
+
+    @cached_property
+    def separate_regexes(self):
+        return [re.compile(p) for p in self.separate]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('regex', None)
+        state.pop('separate_regexes', None)
+        return state
+
+    def match(self, s):
+        if self.regex is not None and self.regex.match(s) is not None:
+            return True
+
+        return any(r.match(s) is not None for r in self.separate_regexes)
+
+
+class RenameRules:
+    """A list of (pattern, replacement) rules applied in order
+
+    The result is the same as:
+
+        for p, replacement in rules:
+            if p.match(path) is not None:
+                path = p.sub(replacement, path)
+
+    but the rules are indexed in a trie by the literal prefix of the
+    pattern, so a path is only matched against rules that could apply to it.
+    Each pattern is only compiled the first time a path reaches it.
+    """
+    def __init__(self, patterns):
+        self.rules = []
+        self.trie = {}
+        self.compiled = {}
+
+        for index, (pattern, replacement) in enumerate(patterns):
+            # A ^-anchored pattern can only match once, so we can expand the
+            # match we already have rather than calling sub()
+            anchored = pattern.startswith('^') and not has_top_level_alternation(pattern)
+            self.rules.append((pattern, replacement, anchored))
+
+            node = self.trie
+            for c in literal_prefix(pattern):
+                node = node.setdefault(c, {})
+            node.setdefault(None, []).append(index)
+
+    def _candidates(self, path):
+        node = self.trie
+        result = list(node.get(None, ()))
+        for c in path:
+            node = node.get(c)
+            if node is None:
+                break
+            result.extend(node.get(None, ()))
+        result.sort()
+
+        return result
+
+    def _compile(self, index):
+        p = self.compiled.get(index)
+        if p is None:
+            p = self.compiled[index] = re.compile(self.rules[index][0])
+
+        return p
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['compiled'] = {}
+        return state
+
+    def apply(self, path):
+        last = -1
+        while True:
+            for index in self._candidates(path):
+                if index <= last:
+                    continue
+                last = index
+
+                _, replacement, anchored = self.rules[index]
+                p = self._compile(index)
+                m = p.match(path)
+                if m is not None:
+                    if anchored:
+                        path = m.expand(replacement) + path[m.end():]
+                    else:
+                        path = p.sub(replacement, path)
+                    # The path changed, so the applicable rules may have too
+                    break
+            else:
+                return path
+
+
+class Rules:
+    """The rules from data/resolve-rules.toml that apply to one kind of runtime
+
+    ignore and rename are the expanded sets of exact paths; the other
+    attributes are the PatternSet and RenameRules built from the regular
+    expressions.
+    """
+    def __init__(self, data, platform):
+        self.ignore = set()
+        for entry in data.get('ignore', []):
+            if entry.get('platform', False) and not platform:
+                continue
+            for d in entry['dirs']:
+                self.ignore.update(d + f for f in entry['files'])
+
+        # Later entries override earlier ones
+        self.rename = {}
+        for entry in data.get('rename', []):
+            for d in entry.get('dirs', []):
+                for old, new in entry['files'].items():
+                    self.rename[d + old] = d + new
+            for name in entry.get('names', []):
+                self.rename[entry['from_dir'] + name] = entry['to_dir'] + name
+
+        patterns = data.get('patterns', {})
+        self.ignore_patterns = PatternSet(patterns.get('ignore', []))
+        self.rename_patterns = RenameRules(patterns.get('rename', []))
+
+        packages = data.get('packages', {})
+        self.package_ignore = PatternSet(packages.get('ignore', []))
+        self.platform_package_ignore = PatternSet(
+            packages.get('platform_ignore', []) if platform else []
+        )
+
+
+# Bump when the contents of Rules change, so old caches aren't used
+RULES_CACHE_VERSION = 2
+
+def load_rules(path, platform):
+    """Loads the Rules in path, from a cache in out/ if the file hasn't changed"""
+    with open(path, 'rb') as f:
+        contents = f.read()
+
+    cache_path = os.path.join(
+        'out', 'resolve-rules-' + ('platform' if platform else 'sdk') + '.cache'
+    )
+    key = '{}:{}'.format(RULES_CACHE_VERSION, hashlib.sha256(contents).hexdigest())
+
+    rules = util.read_cache(cache_path, 'resolve-rules', key)
+    if rules is not None:
+        return rules
+
+    start("Compiling " + path)
+    rules = Rules(tomllib.loads(contents.decode('utf-8')), platform)
+    util.write_cache(cache_path, 'resolve-rules', key, rules)
+    done()
+
+    return rules
@@ -1,17 +1,29 @@
+from abc import ABC, abstractmethod
+import array
+import atexit
 import collections.abc
+import concurrent.futures
 from dataclasses import dataclass
 from functools import cached_property
 import gzip
 import hashlib
+import inspect
+import json
+import mmap
+import multiprocessing
 from pathlib import Path
 import pickle
-from typing import Iterable, List, Mapping
+from typing import Dict, Iterable, List, Mapping
 import rpm
 import os
+import struct
 import subprocess
 import sys
+import threading
 import xml.etree.ElementTree as ET
 import xml.sax
+from xml.sax.saxutils import escape
+import zlib
 import zstandard
 
 import config
@@ -31,13 +43,52 @@ def error(msg):
     print("{}: \033[31m{}\033[39m".format(_log_name, msg), file=sys.stderr)
     sys.exit(1)
 
+# In worker processes and threads other than the main thread, output from
+# several workers is interleaved, so start() and done() print a single
+# complete line when the step finishes.
+_in_worker = False
+_started = threading.local()
+
+def _init_worker(log_name):
+    global _in_worker
+    set_log_name(log_name)
+    _in_worker = True
+
+def _single_line():
+    return _in_worker or threading.current_thread() is not threading.main_thread()
+
 def start(msg):
+    if _single_line():
+        _started.msg = msg
+        return
     print("{}: \033[90m{} ... \033[39m".format(_log_name, msg), file=sys.stderr, end="")
     sys.stderr.flush()
 
 def done():
+    if _single_line():
+        print("{}: \033[90m{} ... done\033[39m".format(_log_name, _started.msg),
+              file=sys.stderr)
+        return
     print("\033[90mdone\033[39m", file=sys.stderr)
 
+def write_if_changed(path, contents):
+    """Writes contents to path, unless the file already has exactly those contents
+
+    Leaving an unchanged file alone keeps its timestamp, so make doesn't
+    rebuild the targets that depend on it.
+    """
+    try:
+        with open(path) as f:
+            if f.read() == contents:
+                return False
+    except FileNotFoundError:
+        pass
+
+    with open(path, 'w') as f:
+        f.write(contents)
+
+    return True
+
 def package_cmp(p1, p2):
     n1, e1, v1, r1, a1 = p1
     n2, e2, v2, r2, a2 = p2
@@ -77,17 +128,123 @@ def package_cmp(p1, p2):
     return - rpm.labelCompare((e1, v1, r1), (e2, v2, r2))
 
 
-def depchase_output(args, arch="amd64", platform_only=False):
-    repo_args = config.REPO_ARGS
-    if not platform_only:
-        repo_args += config.SDK_EXTRA_REPO_ARGS
+def _depchase_repo_args(platform_only):
+    if platform_only:
+        return config.REPO_ARGS
+    else:
+        return config.REPO_ARGS + config.SDK_EXTRA_REPO_ARGS
 
+
+def _run_depchase(args, arch, platform_only):
     return subprocess.check_output(
-        ['flatpak-container-depchase'] + repo_args + ["--arch", arch] + args,
+        ['flatpak-container-depchase'] + _depchase_repo_args(platform_only)
+        + ["--arch", arch] + args,
         encoding='utf-8'
     )
 
 
+_depchase_cache_lock = threading.Lock()
+_depchase_cache_stats = {'hits': 0, 'misses': 0}
+
+def _report_depchase_cache_stats():
+    print("{}: \033[90mflatpak-container-depchase cache: {} hits, {} misses\033[39m".format(
+        _log_name, _depchase_cache_stats['hits'], _depchase_cache_stats['misses']
+    ), file=sys.stderr)
+
+def _count_depchase_cache(result):
+    with _depchase_cache_lock:
+        if _depchase_cache_stats['hits'] + _depchase_cache_stats['misses'] == 0:
+            atexit.register(_report_depchase_cache_stats)
+        _depchase_cache_stats[result] += 1
+
+
+def depchase_repos_key(arch="amd64", platform_only=False):
+    """Returns a string that changes when the repositories depchase uses change"""
+    repos = RepoInfo.fetch(platform_only=platform_only, arch=arch)
+
+    return json.dumps({
+        'arch': arch,
+        'repo_args': _depchase_repo_args(platform_only),
+        'repos': [[r.name, _repo_hash(r)] for r in repos],
+    })
+
+
+_depchase_pruned = set()
+
+def _prune_depchase_cache(prefix):
+    """Deletes the cached depchase output for older versions of the repositories in prefix"""
+    group = prefix.rsplit('-', 2)[0] + '-'
+    with _depchase_cache_lock:
+        if group in _depchase_pruned:
+            return
+        _depchase_pruned.add(group)
+
+    try:
+        filenames = os.listdir('out')
+    except FileNotFoundError:
+        return
+    for filename in filenames:
+        if filename.startswith(group) and not filename.startswith(prefix):
+            try:
+                os.unlink(os.path.join('out', filename))
+            except FileNotFoundError:
+                pass
+
+
+def depchase_output(args, arch="amd64", platform_only=False, input_files=()):
+    """Runs flatpak-container-depchase and returns its output
+
+    Except for fetch-metadata, the output is cached in out/, keyed on the
+    arguments, the repositories they are run against, and the contents of
+    input_files - any of the arguments that name files for depchase to read.
+    """
+    if args[0] == 'fetch-metadata':
+        return _run_depchase(args, arch, platform_only)
+
+    key_args = []
+    for arg in args:
+        if arg in input_files:
+            with open(arg, 'rb') as f:
+                arg = 'file:' + hashlib.sha256(f.read()).hexdigest()
+        key_args.append(arg)
+
+    repos_key = depchase_repos_key(arch=arch, platform_only=platform_only)
+    key = json.dumps({
+        'args': key_args,
+        'repos': repos_key,
+    })
+    # Every set of arguments gets its own file, so the files are grouped by
+    # repositories, and the groups for repositories that have since changed
+    # are deleted
+    prefix = 'depchase-{}-{}-{}-'.format(
+        arch, "platform" if platform_only else "all",
+        hashlib.sha256(repos_key.encode('utf-8')).hexdigest()[:16]
+    )
+    _prune_depchase_cache(prefix)
+    cache_path = os.path.join(
+        'out', prefix + hashlib.sha256(key.encode('utf-8')).hexdigest() + '.cache'
+    )
+
+    output = read_cache(cache_path, 'depchase', key)
+    if output is not None:
+        _count_depchase_cache('hits')
+        return output
+
+    output = _run_depchase(args, arch, platform_only)
+    write_cache(cache_path, 'depchase', key, output)
+    _count_depchase_cache('misses')
+
+    return output
+
+
+# RepoInfo.fetch() results, by (platform_only, arch)
+_fetched: Dict[tuple, List['RepoInfo']] = {}
+# One lock per key, so fetches for different keys run at the same time;
+# _fetch_locks_lock guards the dict itself
+_fetch_locks: Dict[tuple, threading.Lock] = {}
+_fetch_locks_lock = threading.Lock()
+
+
 @dataclass
 class RepoInfo():
     name: str
@@ -99,15 +256,25 @@ class RepoInfo():
             return f.read()
 
     @staticmethod
-    def fetch(platform_only=False):
-        repo_infos: List[RepoInfo] = []
-
-        for line in depchase_output(["fetch-metadata", "--print-location"],
-                                    platform_only=platform_only).strip().split("\n"):
-            name, metadata_path = [p.strip() for p in line.split()]
-            repo_infos.append(RepoInfo(name, Path(metadata_path)))
-
-        return repo_infos
+    def fetch(platform_only=False, arch="amd64"):
+        """Updates the metadata for the repositories, once per process"""
+        key = (platform_only, arch)
+        with _fetch_locks_lock:
+            lock = _fetch_locks.setdefault(key, threading.Lock())
+
+        with lock:
+            repo_infos = _fetched.get(key)
+            if repo_infos is None:
+                repo_infos = []
+                for line in depchase_output(["fetch-metadata", "--print-location"],
+                                            arch=arch,
+                                            platform_only=platform_only).strip().split("\n"):
+                    name, metadata_path = [p.strip() for p in line.split()]
+                    repo_infos.append(RepoInfo(name, Path(metadata_path)))
+
+                _fetched[key] = repo_infos
+
+        return list(repo_infos)
 
     def get_metadata_file(self, type_):
         root = ET.fromstring(self.repomd_contents)
@@ -122,6 +289,83 @@ class RepoInfo():
         return path
 
 
+# How many records are collected before they are handed to a callback
+BATCH_SIZE = 1000
+
+# XML parser used for repository metadata - 'etree' (the C accelerated
+# xml.etree.ElementTree.iterparse), or 'sax' (the original xml.sax handlers,
+# kept as a fallback)
+XML_BACKEND = os.environ.get("XML_BACKEND") or 'etree'
+
+FILELISTS_NS = '{http://linux.duke.edu/metadata/filelists}'
+COMMON_NS = '{http://linux.duke.edu/metadata/common}'
+RPM_NS = '{http://linux.duke.edu/metadata/rpm}'
+
+
+def _open_metadata(path):
+    if os.path.splitext(path)[1] == '.zst':
+        return zstandard.open(path, 'rb')
+    else:
+        return gzip.open(path, 'rb')
+
+
+class _Batcher:
+    """Groups records into lists of BATCH_SIZE before passing them on"""
+    def __init__(self, cb):
+        self.cb = cb
+        self.batch = []
+
+    def add(self, record):
+        self.batch.append(record)
+        if len(self.batch) >= BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.batch:
+            self.cb(self.batch)
+            self.batch = []
+
+
+def _iterparse_packages(f, tag):
+    # The tree is built in C; we only look at completed <package> elements,
+    # and clear them afterwards so memory use doesn't grow with the file.
+    for event, elem in ET.iterparse(f, events=('end',)):
+        if elem.tag == tag:
+            yield elem
+            elem.clear()
+
+
+# How much of the decompressed metadata is read at a time when scanning
+# it without parsing all of it
+READ_SIZE = 1 << 20
+
+def _matching_package_elements(f, needles):
+    """Yields each <package> element in f whose raw XML contains any of needles
+
+    The raw bytes of each package are searched first, and only the packages
+    that could match are parsed, so the rest never become Python objects.
+    The elements are parsed on their own, so their tags have no namespace.
+    """
+    end_tag = b'</package>'
+    buf = b''
+    while True:
+        data = f.read(READ_SIZE)
+        if not data:
+            break
+
+        buf += data
+        start = 0
+        while True:
+            end = buf.find(end_tag, start)
+            if end < 0:
+                break
+            end += len(end_tag)
+            if any(buf.find(n, start, end) >= 0 for n in needles):
+                yield ET.fromstring(buf[buf.find(b'<package', start, end):end])
+            start = end
+        buf = buf[start:]
+
+
 class FilesMapHandler(xml.sax.ContentHandler):
     def __init__(self, cb):
         self.cb = cb
@@ -160,17 +404,61 @@ class FilesMapHandler(xml.sax.ContentHandler):
             self.file += content
 
 
-def foreach_file(repo_info: RepoInfo, cb):
-    start(f"Scanning files for {repo_info.name}")
-    filelists_path = repo_info.get_metadata_file("filelists")
+def foreach_file(repo_info: RepoInfo, cb, backend=None, path_prefixes=None):
+    """Calls cb with batches of (package_info, [file, ...]) records
 
-    handler = FilesMapHandler(cb)
-    if os.path.splitext(filelists_path)[1] == '.zst':
-        f = zstandard.open(filelists_path, 'rb')
+    If path_prefixes is given, only files starting with one of them are
+    included, and packages without any such files are skipped.
+    """
+    if path_prefixes is None:
+        start(f"Scanning files for {repo_info.name}")
     else:
-        f = gzip.open(filelists_path, 'rb')
-    xml.sax.parse(f, handler)
-    f.close()
+        path_prefixes = tuple(path_prefixes)
+        start(f"Scanning files in {', '.join(path_prefixes)} for {repo_info.name}")
+    filelists_path = repo_info.get_metadata_file("filelists")
+
+    batcher = _Batcher(cb)
+    with _open_metadata(filelists_path) as f:
+        if (backend or XML_BACKEND) == 'sax':
+            package_files = None
+
+            def file_cb(package_info, file):
+                nonlocal package_files
+                if path_prefixes is not None and not file.startswith(path_prefixes):
+                    return
+                if package_files is None or package_files[0] is not package_info:
+                    if package_files is not None:
+                        batcher.add(package_files)
+                    package_files = (package_info, [])
+                package_files[1].append(file)
+
+            xml.sax.parse(f, FilesMapHandler(file_cb))
+            if package_files is not None:
+                batcher.add(package_files)
+        elif path_prefixes is not None:
+            # The text of a <file> element that starts with a prefix starts
+            # with the escaped prefix in the XML
+            needles = [b'>' + escape(p).encode('utf-8') for p in path_prefixes]
+            for package in _matching_package_elements(f, needles):
+                attrs = package.attrib
+                version = package.find('version').attrib
+                package_info = (attrs['name'], version['epoch'], version['ver'], version['rel'],
+                                attrs['arch'])
+                files = [e.text for e in package
+                         if e.tag == 'file' and e.text and e.text.startswith(path_prefixes)]
+                if files:
+                    batcher.add((package_info, files))
+        else:
+            file_tag = FILELISTS_NS + 'file'
+            for package in _iterparse_packages(f, FILELISTS_NS + 'package'):
+                attrs = package.attrib
+                version = package.find(FILELISTS_NS + 'version').attrib
+                package_info = (attrs['name'], version['epoch'], version['ver'], version['rel'],
+                                attrs['arch'])
+                files = [e.text or '' for e in package if e.tag == file_tag]
+                if files:
+                    batcher.add((package_info, files))
+    batcher.flush()
 
     done()
 
@@ -205,49 +493,520 @@ class PackageMapHandler(xml.sax.ContentHandler):
             self.chars += content
 
 
-def foreach_package(repo_info: RepoInfo, cb):
-    start(f"Scanning files for {repo_info.name}")
+def foreach_package(repo_info: RepoInfo, cb, backend=None):
+    """Calls cb with batches of (name, sourcerpm) records"""
+    start(f"Scanning packages for {repo_info.name}")
 
     primary_path = repo_info.get_metadata_file("primary")
-    handler = PackageMapHandler(cb)
-    if os.path.splitext(primary_path)[1] == '.zst':
-        f = zstandard.open(primary_path, 'rb')
-    else:
-        f = gzip.open(primary_path, 'rb')
-    xml.sax.parse(f, handler)
-    f.close()
+    batcher = _Batcher(cb)
+    with _open_metadata(primary_path) as f:
+        if (backend or XML_BACKEND) == 'sax':
+            xml.sax.parse(f, PackageMapHandler(lambda *record: batcher.add(record)))
+        else:
+            name_path = COMMON_NS + 'name'
+            sourcerpm_path = COMMON_NS + 'format/' + RPM_NS + 'sourcerpm'
+            for package in _iterparse_packages(f, COMMON_NS + 'package'):
+                batcher.add((package.findtext(name_path), package.findtext(sourcerpm_path)))
+    batcher.flush()
 
     done()
 
 
-def _get_repo_cacheable(repo_info, name, generate):
-    repo_hash = hashlib.sha256(repo_info.repomd_contents).hexdigest()
+# Cached data in out/ is stored as:
+#
+#   CACHE_MAGIC
+#   one line of JSON: {"version": CACHE_FORMAT_VERSION, "codec": ..., "generator": ..., "key": ...}
+#   the pickled data, compressed with the codec
+#
+# A cache is only used if all of the header matches what the reader expects,
+# otherwise it is treated as missing and regenerated.
+
+CACHE_MAGIC = b'FRCACHE\n'
+CACHE_FORMAT_VERSION = 1
+CACHE_PICKLE_PROTOCOL = 5
+
+
+class ZstdCodec:
+    name = 'zstd'
+
+    @staticmethod
+    def reader(f):
+        return zstandard.ZstdDecompressor().stream_reader(f)
+
+    @staticmethod
+    def writer(f):
+        return zstandard.ZstdCompressor(level=3, threads=-1).stream_writer(f, closefd=False)
 
-    cache_path = os.path.join('out', name + "-" + repo_info.name + ".gz")
 
+class GzipCodec:
+    name = 'gzip'
+
+    @staticmethod
+    def reader(f):
+        return gzip.GzipFile(fileobj=f, mode='rb')
+
+    @staticmethod
+    def writer(f):
+        return gzip.GzipFile(fileobj=f, mode='wb', compresslevel=6)
+
+
+CACHE_CODECS = {c.name: c for c in (ZstdCodec, GzipCodec)}
+
+try:
+    import lz4.frame
+
+    class Lz4Codec:
+        name = 'lz4'
+
+        @staticmethod
+        def reader(f):
+            return lz4.frame.LZ4FrameFile(f, mode='rb')
+
+        @staticmethod
+        def writer(f):
+            return lz4.frame.LZ4FrameFile(f, mode='wb')
+
+    CACHE_CODECS[Lz4Codec.name] = Lz4Codec
+except ImportError:
+    pass
+
+# Codec used when writing caches; any known codec can be read
+CACHE_CODEC = os.environ.get("CACHE_CODEC") or 'zstd'
+
+
+def _read_cache_header(f):
+    if f.read(len(CACHE_MAGIC)) != CACHE_MAGIC:
+        return None
+    try:
+        return json.loads(f.readline())
+    except ValueError:
+        return None
+
+
+def read_cache(path, generator, key, header_only=False):
+    """Returns the data stored by write_cache(), or None if missing or stale"""
     try:
-        with gzip.open(cache_path, 'rb') as f:
-            old_repo_hash = f.read(64).decode('utf-8')
-            if old_repo_hash == repo_hash:
-                start("Reading " + name)
-                data = pickle.load(f)
-                done()
-
-                return data
+        with open(path, 'rb') as f:
+            header = _read_cache_header(f)
+            if (header is None
+                    or header.get('version') != CACHE_FORMAT_VERSION
+                    or header.get('generator') != generator
+                    or header.get('key') != key
+                    or header.get('codec') not in CACHE_CODECS):
+                return None
+            if header_only:
+                return True
+
+            with CACHE_CODECS[header['codec']].reader(f) as reader:
+                return pickle.loads(reader.read())
     except FileNotFoundError:
+        return None
+    except (EOFError, OSError, ValueError, pickle.UnpicklingError, zstandard.ZstdError) as e:
+        warn(f"{path}: ignoring unreadable cache: {e}")
+        return None
+
+
+def write_cache(path, generator, key, data):
+    codec = CACHE_CODECS[CACHE_CODEC]
+    header = {
+        'version': CACHE_FORMAT_VERSION,
+        'codec': codec.name,
+        'generator': generator,
+        'key': key,
+    }
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(CACHE_MAGIC)
+        f.write(json.dumps(header).encode('utf-8') + b'\n')
+        with codec.writer(f) as writer:
+            pickle.dump(data, writer, protocol=CACHE_PICKLE_PROTOCOL)
+    os.rename(tmp_path, path)
+
+
+class RepoMapBuilder(ABC):
+    """Accumulates one derived map during a scan of a repository's metadata.
+
+    Every registered builder is fed from the same pass over filelists.xml
+    (add_files()) and the same pass over primary.xml (add_packages()), so
+    building several maps only reads each metadata file once. Both are
+    called with batches of records, see foreach_file() and foreach_package().
+    """
+    name: str
+    uses_filelists = False
+    uses_primary = False
+    # If set, add_files() is only passed the files starting with one of
+    # these, which is much cheaper than scanning every file
+    path_prefixes = None
+
+    def add_files(self, records):
         pass
 
-    data = generate(repo_info)
+    def add_packages(self, records):
+        pass
 
-    start("Writing " + name)
-    with gzip.open(cache_path, 'wb') as f:
-        f.write(repo_hash.encode('utf-8'))
-        pickle.dump(data, f)
+    @abstractmethod
+    def finish(self):
+        """Returns the finished map"""
+
+    # How the finished map is stored in out/
+    cache_suffix = '.cache'
+
+    @classmethod
+    def read_cache(cls, path, repo_hash, header_only=False):
+        return read_cache(path, cls.name, repo_hash, header_only=header_only)
+
+    @classmethod
+    def write_cache(cls, path, repo_hash, data):
+        write_cache(path, cls.name, repo_hash, data)
+
+
+_repo_map_builders = {}
+
+def register_repo_map(cls):
+    if inspect.isabstract(cls):
+        raise TypeError(f"{cls.__name__} doesn't implement "
+                        + ", ".join(sorted(cls.__abstractmethods__)))
+    _repo_map_builders[cls.name] = cls
+    return cls
+
+
+class FilesIndex(collections.abc.Mapping):
+    """Read-only mapping from paths to package names, stored as a hash table in a file
+
+    The file is accessed with mmap, so opening it is instant, and only the
+    pages touched by lookups are ever read into memory.
+
+    Layout (native byte order):
+      header: magic, repo hash, entry count, slot count, names offset, paths offset
+      slots: n_slots path hashes (uint32), n_slots name IDs (uint32),
+             n_slots path offsets (uint64)
+      names: newline-separated package names, indexed by name ID
+      paths: NUL-terminated UTF-8 paths
+
+    Collisions are resolved by linear probing; an empty slot has a name ID
+    of EMPTY. The format version is part of MAGIC.
+    """
+    MAGIC = b'FRFIDX01'
+    HEADER = struct.Struct('=8s64sQQQQ')
+    EMPTY = 0xffffffff
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        # Lookups are scattered over the file; don't read ahead
+        self.mm.madvise(mmap.MADV_RANDOM)
+
+        (magic, self.repo_hash, self.n_entries, n_slots,
+         names_offset, paths_offset) = self.HEADER.unpack_from(self.mm)
+        if magic != self.MAGIC:
+            raise ValueError(f"{path}: not a files index")
+        self.repo_hash = self.repo_hash.decode('utf-8')
+
+        self.mask = n_slots - 1
+        view = memoryview(self.mm)
+        offset = self.HEADER.size
+        self.hashes = view[offset:offset + 4 * n_slots].cast('I')
+        offset += 4 * n_slots
+        self.name_ids = view[offset:offset + 4 * n_slots].cast('I')
+        offset += 4 * n_slots
+        self.offsets = view[offset:offset + 8 * n_slots].cast('Q')
+
+        self.names = self.mm[names_offset:paths_offset].decode('utf-8').split('\n')
+        self.paths_offset = paths_offset
+
+    @staticmethod
+    def read_header(path):
+        with open(path, 'rb') as f:
+            header = f.read(FilesIndex.HEADER.size)
+        if len(header) != FilesIndex.HEADER.size:
+            return None
+        magic, repo_hash, *rest = FilesIndex.HEADER.unpack(header)
+        if magic != FilesIndex.MAGIC:
+            return None
+
+        return repo_hash.decode('utf-8')
+
+    @staticmethod
+    def write(path, repo_hash, files_map: Mapping[str, str]):
+        n_entries = len(files_map)
+        n_slots = 1
+        while n_slots < n_entries * 4 // 3 + 1:
+            n_slots *= 2
+        mask = n_slots - 1
+
+        EMPTY = FilesIndex.EMPTY
+        hashes = array.array('I', bytes(4 * n_slots))
+        name_ids = array.array('I', [EMPTY]) * n_slots
+        offsets = array.array('Q', bytes(8 * n_slots))
+        names: Dict[str, int] = {}
+        paths = []
+
+        offset = 0
+        for path_str, name in files_map.items():
+            name_id = names.setdefault(name, len(names))
+            encoded = path_str.encode('utf-8')
+            h = zlib.crc32(encoded)
+            i = h & mask
+            while name_ids[i] != EMPTY:
+                i = (i + 1) & mask
+            hashes[i] = h
+            name_ids[i] = name_id
+            offsets[i] = offset
+            paths.append(encoded)
+            offset += len(encoded) + 1
+
+        names_blob = '\n'.join(names).encode('utf-8')
+        names_offset = FilesIndex.HEADER.size + 16 * n_slots
+
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(FilesIndex.HEADER.pack(FilesIndex.MAGIC, repo_hash.encode('utf-8'),
+                                           n_entries, n_slots,
+                                           names_offset, names_offset + len(names_blob)))
+            hashes.tofile(f)
+            name_ids.tofile(f)
+            offsets.tofile(f)
+            f.write(names_blob)
+            for encoded in paths:
+                f.write(encoded)
+                f.write(b'\0')
+        os.rename(tmp_path, path)
+
+    def _lookup(self, key):
+        encoded = key.encode('utf-8')
+        h = zlib.crc32(encoded)
+        mask = self.mask
+        i = h & mask
+        while True:
+            name_id = self.name_ids[i]
+            if name_id == self.EMPTY:
+                return None
+            if self.hashes[i] == h:
+                start = self.paths_offset + self.offsets[i]
+                end = start + len(encoded)
+                if self.mm[start:end] == encoded and self.mm[end] == 0:
+                    return self.names[name_id]
+            i = (i + 1) & mask
+
+    def __getitem__(self, key):
+        result = self._lookup(key)
+        if result is None:
+            raise KeyError(key)
+
+        return result
+
+    def __contains__(self, key):
+        return self._lookup(key) is not None
+
+    def get(self, key, default=None):
+        result = self._lookup(key)
+        return default if result is None else result
+
+    def __iter__(self):
+        return (path for path, name in self.items())
+
+    def items(self):
+        # Walking the slots is much faster than iterating the keys and
+        # looking each one up again
+        mm = self.mm
+        paths_offset = self.paths_offset
+        names = self.names
+        for i, name_id in enumerate(self.name_ids):
+            if name_id != self.EMPTY:
+                start = paths_offset + self.offsets[i]
+                yield mm[start:mm.find(b'\0', start)].decode('utf-8'), names[name_id]
+
+    def __len__(self):
+        return self.n_entries
+
+
+# We need to look up a lot of file dependencies. dnf/libsolv is not fast at doing
+# this (at least when we look up files one-by-one) so we create a hash table that
+# maps from *all* files in the distribution to the "best" package that provides
+# the file. To further speed this up, we store the result and only recreate it when
+# the DNF metadata changes. It is stored as a FilesIndex rather than a pickle, since
+# unpickling the full map (700M in memory) takes seconds, while we typically only
+# look up a few thousand paths.
+#
+@register_repo_map
+class FilesMapBuilder(RepoMapBuilder):
+    name = 'files-map'
+    uses_filelists = True
+
+    def __init__(self):
+        self.files_map = {}
+
+    def add_files(self, records):
+        files_map = self.files_map
+        for package_info, files in records:
+            for f in files:
+                old = files_map.get(f)
+                if old is None or package_cmp(package_info, old) < 0:
+                    files_map[f] = package_info
+
+    def finish(self):
+        files_map = self.files_map
+        for k in files_map:
+            files_map[k] = files_map[k][0]
+
+        return files_map
+
+    cache_suffix = '.idx'
+
+    @classmethod
+    def read_cache(cls, path, repo_hash, header_only=False):
+        if FilesIndex.read_header(path) != repo_hash:
+            return None
+        if header_only:
+            return True
+
+        return FilesIndex(path)
+
+    @classmethod
+    def write_cache(cls, path, repo_hash, data):
+        FilesIndex.write(path, repo_hash, data)
+
+
+@register_repo_map
+class DesktopMapBuilder(RepoMapBuilder):
+    name = 'desktop-map'
+    uses_filelists = True
+    path_prefixes = ("/usr/share/applications/",)
+
+    def __init__(self):
+        self.desktop_map = {}
+
+    def add_files(self, records):
+        desktop_map = self.desktop_map
+        for package_info, files in records:
+            for f in files:
+                if f.startswith("/usr/share/applications/"):
+                    desktop_id = os.path.basename(f)
+                    old = desktop_map.get(desktop_id)
+                    if old is None or package_cmp(package_info, old) < 0:
+                        desktop_map[desktop_id] = package_info
+
+    def finish(self):
+        desktop_map = self.desktop_map
+        for k in desktop_map:
+            desktop_map[k] = desktop_map[k][0]
+
+        return desktop_map
+
+
+@register_repo_map
+class DevelPackagesBuilder(RepoMapBuilder):
+    name = 'devel-packages'
+    uses_primary = True
+
+    def __init__(self):
+        self.devel_packages = {}
+
+    def add_packages(self, records):
+        for name, sourcerpm in records:
+            if name.endswith('-devel') and name != 'gdk-pixbuf2-xlib-devel':
+                srpm_name = sourcerpm.rsplit('-', 2)[0]
+                self.devel_packages[srpm_name] = name
+
+    def finish(self):
+        return self.devel_packages
+
+
+def scan_repo(repo_info: RepoInfo, builders: List[RepoMapBuilder]):
+    file_builders = [b for b in builders if b.uses_filelists]
+    if file_builders:
+        def file_cb(records):
+            for b in file_builders:
+                b.add_files(records)
+
+        if any(b.path_prefixes is None for b in file_builders):
+            path_prefixes = None
+        else:
+            path_prefixes = [p for b in file_builders for p in b.path_prefixes]
+
+        foreach_file(repo_info, file_cb, path_prefixes=path_prefixes)
+
+    package_builders = [b for b in builders if b.uses_primary]
+    if package_builders:
+        def package_cb(records):
+            for b in package_builders:
+                b.add_packages(records)
+
+        foreach_package(repo_info, package_cb)
+
+    start("Finalizing " + ", ".join(b.name for b in builders))
+    result = {b.name: b.finish() for b in builders}
+    done()
+
+    return result
+
+
+def _repo_cache_path(repo_info, name):
+    return os.path.join('out', name + "-" + repo_info.name + _repo_map_builders[name].cache_suffix)
+
+
+def _read_repo_cache(repo_info, name, repo_hash, header_only=False):
+    builder = _repo_map_builders[name]
+    path = _repo_cache_path(repo_info, name)
+    try:
+        if not builder.read_cache(path, repo_hash, header_only=True):
+            return None
+    except FileNotFoundError:
+        return None
+
+    if header_only:
+        return True
+
+    start("Reading " + name)
+    data = builder.read_cache(path, repo_hash)
     done()
 
     return data
 
 
+def _write_repo_cache(repo_info, name, repo_hash, data):
+    start("Writing " + name)
+    _repo_map_builders[name].write_cache(_repo_cache_path(repo_info, name), repo_hash, data)
+    done()
+
+
+def _repo_hash(repo_info):
+    return hashlib.sha256(repo_info.repomd_contents).hexdigest()
+
+
+def _update_repo_caches(repo_info, name):
+    """Builds every out-of-date map for the repository; name is always rebuilt"""
+    repo_hash = _repo_hash(repo_info)
+
+    # Since we have to scan the repository anyways, build every other map
+    # that is out of date at the same time - but a map that only needs some
+    # of the files doesn't pay for a full scan of them to build the others.
+    narrow = _repo_map_builders[name].path_prefixes is not None
+
+    def shares_scan(n):
+        builder = _repo_map_builders[n]
+        return not (narrow and builder.uses_filelists and builder.path_prefixes is None)
+
+    stale = [n for n in _repo_map_builders
+             if n == name or (shares_scan(n)
+                              and _read_repo_cache(repo_info, n, repo_hash,
+                                                   header_only=True) is None)]
+    maps = scan_repo(repo_info, [_repo_map_builders[n]() for n in stale])
+    for n in stale:
+        _write_repo_cache(repo_info, n, repo_hash, maps[n])
+
+    return maps
+
+
+def _get_repo_cacheable(repo_info, name):
+    data = _read_repo_cache(repo_info, name, _repo_hash(repo_info))
+    if data is not None:
+        return data
+
+    return _update_repo_caches(repo_info, name)[name]
+
+
 class UnionMapping(collections.abc.Mapping):
     def __init__(self, children: Iterable[Mapping]):
         self.children = children
@@ -276,8 +1035,79 @@ class UnionMapping(collections.abc.Mapping):
         return sum(len(child) for child in self.children)
 
 
-def get_repo_map(name, generate, platform_only=False):
+def _update_repo_caches_in_worker(repo_info, name):
+    _update_repo_caches(repo_info, name)
+
+
+def _get_repo_maps(name, repos):
+
+    # Scanning a repository is CPU-bound, so when more than one repository
+    # needs to be scanned, do that in separate processes, then read back the
+    # caches they wrote. The workers are forked: the scripts do their work
+    # at module level, so the spawn and forkserver start methods (the
+    # default from Python 3.14) would run the whole script again in each
+    # worker when they import __main__.
+    stale = [r for r in repos
+             if _read_repo_cache(r, name, _repo_hash(r), header_only=True) is None]
+    if len(stale) > 1 and config.JOBS > 1:
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=min(config.JOBS, len(stale)),
+            mp_context=multiprocessing.get_context('fork'),
+            initializer=_init_worker, initargs=(_log_name,)
+        ) as executor:
+            futures = [executor.submit(_update_repo_caches_in_worker, r, name) for r in stale]
+            for future in concurrent.futures.as_completed(futures):
+                future.result()
+
+    return [_get_repo_cacheable(r, name) for r in repos]
+
+
+def get_repo_map(name, platform_only=False):
+    repos = RepoInfo.fetch(platform_only=platform_only)
+
+    return UnionMapping(_get_repo_maps(name, repos))
+
+
+def get_merged_repo_map(name, platform_only=False):
+    """Like get_repo_map(), but merges the per-repository maps into one
+
+    The merged map is cached in out/ like the per-repository maps, and
+    regenerated when any of the repositories change. Lookups then only
+    need to probe one map rather than each repository in turn.
+    """
     repos = RepoInfo.fetch(platform_only=platform_only)
-    child_maps = [_get_repo_cacheable(r, name, generate) for r in repos]
+    if len(repos) == 1:
+        return _get_repo_maps(name, repos)[0]
+
+    builder = _repo_map_builders[name]
+    cache_path = os.path.join(
+        'out', name + "-merged-" + ("platform" if platform_only else "all") + builder.cache_suffix
+    )
+    key = hashlib.sha256(
+        "".join(r.name + ":" + _repo_hash(r) + "\n" for r in repos).encode('utf-8')
+    ).hexdigest()
+
+    try:
+        if builder.read_cache(cache_path, key, header_only=True):
+            start("Reading merged " + name)
+            data = builder.read_cache(cache_path, key)
+            done()
+
+            return data
+    except FileNotFoundError:
+        pass
+
+    child_maps = _get_repo_maps(name, repos)
+
+    start("Merging " + name)
+    merged = {}
+    # Earlier repositories take precedence, as in UnionMapping
+    for child in reversed(child_maps):
+        merged.update(child.items())
+    done()
+
+    start("Writing merged " + name)
+    builder.write_cache(cache_path, key, merged)
+    done()
 
-    return UnionMapping(child_maps)
+    return merged